@@ -1,3 +1,4 @@
+import io
 import os
 import warnings
 warnings.filterwarnings("ignore")
@@ -9,15 +10,24 @@ import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from plotly_resampler import FigureResampler
+from tsdownsample import MinMaxLTTBDownsampler
 
 # --- Stats/TS ---
+from scipy.stats import rankdata
 from statsmodels.tsa.seasonal import seasonal_decompose, STL
 
 # --- Data ---
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import pydeck as pdk
 
+# Copy-on-Write: derived frames share data until written, so the defensive
+# .copy() calls below are no longer needed (always on from pandas 3.0).
+pd.set_option('mode.copy_on_write', True)
+
 # =============================
 # 1) Page & Theme
 # =============================
@@ -55,19 +65,34 @@ def _standardize_columns(df: pd.DataFrame) -> pd.DataFrame:
     }
     df = df.rename(columns=rename_map)
     num_cols = ['traffic_volume', 'average_speed', 'incidents', 'latitude', 'longitude']
-    for c in num_cols:
+    present = [c for c in num_cols if c in df.columns]
+    if present:
+        df[present] = df[present].apply(pd.to_numeric, errors='coerce')
+    # Downcast: float32 halves the bytes scanned by groupby/corr/winsorize,
+    # and category turns region groupbys into integer factorizes.
+    for c in ('traffic_volume', 'average_speed', 'latitude', 'longitude'):
         if c in df.columns:
-            df[c] = pd.to_numeric(df[c], errors='coerce')
+            df[c] = df[c].astype('float32')
+    if 'incidents' in df.columns:
+        df['incidents'] = pd.to_numeric(df['incidents'], downcast='integer')
+    if 'region_name' in df.columns:
+        df['region_name'] = df['region_name'].astype('category')
     if 'datetime' in df.columns:
         df['datetime'] = pd.to_datetime(df['datetime'], errors='coerce')
     if 'incidents' not in df.columns:
         df['incidents'] = 0
     if {'latitude', 'longitude'}.issubset(df.columns):
         df = df.dropna(subset=['latitude', 'longitude'])
+    # Any leftover text columns: Arrow-backed strings scan far faster than
+    # object arrays (region_name is already category, see above)
+    obj_cols = [c for c in df.columns if df[c].dtype == object]
+    if obj_cols:
+        df[obj_cols] = df[obj_cols].astype(pd.ArrowDtype(pa.string()))
     return df
 
 @st.cache_data(ttl=3600)
-def load_data(_client, database_name: str, month: str) -> pd.DataFrame:
+def load_data(_client, database_name: str, month: str,
+              max_speed=None, max_volume=None, regions=None, max_rows=None) -> pd.DataFrame:
     if _client is None:
         return pd.DataFrame()
     try:
@@ -75,37 +100,196 @@ def load_data(_client, database_name: str, month: str) -> pd.DataFrame:
         if month not in db.list_collection_names():
             return pd.DataFrame()
         collection = db.get_collection(month)
-        data = list(collection.find({}))
-        if not data:
+        # Evaluate the data-quality guards and region filter server-side so
+        # only qualifying rows cross the wire.
+        filt = {}
+        if max_speed is not None:
+            filt['average_speed'] = {'$lte': max_speed}
+        if max_volume is not None:
+            filt['traffic_volume'] = {'$lte': max_volume}
+        if regions:
+            filt['region_name'] = {'$in': list(regions)}
+        # Project out unused fields server-side and stream in large batches,
+        # filling one buffer per column instead of one dict per document.
+        cursor = collection.find(
+            filt, projection={'_id': 0, 'traffic_id': 0, 'region_id': 0, 'city': 0}
+        ).batch_size(10000)
+        cols = {}
+        n = 0
+        prog = st.progress(0.0, text="Loading rows…") if max_rows else None
+        for doc in cursor:
+            # Union keys across documents: fields are sparse, so a key first
+            # seen mid-stream gets a buffer backfilled with Nones
+            for k in doc:
+                if k not in cols:
+                    cols[k] = [None] * n
+            for k, buf in cols.items():
+                buf.append(doc.get(k))
+            n += 1
+            if max_rows:
+                if n % 10000 == 0:
+                    prog.progress(min(n / max_rows, 1.0), text=f"Loading rows… {n:,}")
+                if n >= max_rows:
+                    break
+        if prog is not None:
+            prog.empty()
+        if not cols:
             return pd.DataFrame()
-        df = pd.DataFrame(data)
-        for col in ['_id', 'traffic_id', 'region_id', 'city']:
-            if col in df.columns:
-                df.drop(columns=col, inplace=True)
+        df = pd.DataFrame({c: np.asarray(buf) for c, buf in cols.items()})
         df = _standardize_columns(df)
         if 'datetime' in df.columns:
-            df['hour'] = df['datetime'].dt.hour
-            df['dow'] = df['datetime'].dt.dayofweek
-            df['is_weekend'] = df['dow'].isin([5, 6]).astype(int)
-            df['month'] = df['datetime'].dt.month
-            df['year'] = df['datetime'].dt.year
-        return df.drop_duplicates()
+            df = df.dropna(subset=['datetime'])
+            df['hour'] = df['datetime'].dt.hour.astype('int8')
+            df['dow'] = df['datetime'].dt.dayofweek.astype('int8')
+            df['is_weekend'] = (df['dow'] >= 5).astype('int8')
+            df['month'] = df['datetime'].dt.month.astype('int8')
+            df['year'] = df['datetime'].dt.year.astype('int16')
+        # Duplicates are identified by the observation key alone — hashing
+        # four columns instead of every field of every row
+        subset = [c for c in ('datetime', 'region_name', 'latitude', 'longitude') if c in df.columns]
+        return df.drop_duplicates(subset=subset or None, ignore_index=True)
     except Exception as e:
         st.error(f"Failed to load data: {e}")
         return pd.DataFrame()
 
 @st.cache_data
 def to_csv_bytes(df: pd.DataFrame):
-    return df.to_csv(index=False).encode('utf-8')
+    # Arrow's C++ CSV writer is several times faster than DataFrame.to_csv
+    buf = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue()
 
 # Utils
+# Visual-only downsampling: keeps extremes/shape for plotting while all
+# statistics stay on the full-resolution series.
+def lttb_points(s: pd.Series, n_out: int = 1500) -> pd.Series:
+    if len(s) <= n_out:
+        return s
+    idx = MinMaxLTTBDownsampler().downsample(
+        s.index.values.astype('int64'), s.values.astype(np.float64), n_out=n_out)
+    return s.iloc[idx]
+
+# Under st.plotly_chart the resampler's zoom/pan callbacks never run, so this
+# is static payload capping only: same 1500-point budget as lttb_points, and
+# no '[R]'/aggregation markers rewriting the trace names.
+def resampler_fig(base_fig):
+    return FigureResampler(base_fig, default_n_shown_samples=1500,
+                           resampled_trace_prefix_suffix=('', ''),
+                           show_mean_aggregation_size=False)
+
 def winsorize(frame: pd.DataFrame, cols, q=(0.01, 0.99)):
-    df = frame.copy()
-    for c in cols:
-        if c in df.columns:
-            lo, hi = df[c].quantile(q)
-            df[c] = df[c].clip(lo, hi)
-    return df
+    present = [c for c in cols if c in frame.columns]
+    if not present:
+        return frame
+    # One C-level pass over the 2D block, vectorized across columns
+    # (copy=True: CoW hands out read-only views, and we clip in place)
+    a = frame[present].to_numpy(dtype=np.float32, copy=True)
+    lo, hi = np.nanquantile(a, q, axis=0)
+    np.clip(a, np.nan_to_num(lo, nan=-np.inf), np.nan_to_num(hi, nan=np.inf), out=a)
+    frame[present] = a
+    return frame
+
+# O(n) cumulative-sum rolling windows, NaN-aware to match
+# rolling(w, min_periods=1) semantics (all-NaN window -> NaN).
+def _roll_sum_cnt(a: np.ndarray, w: int):
+    a = a.astype(np.float64)
+    mask = np.isnan(a)
+    c = np.cumsum(np.insert(np.where(mask, 0.0, a), 0, 0.0))
+    k = np.cumsum(np.insert((~mask).astype(np.float64), 0, 0.0))
+    sums = np.concatenate([c[1:w], c[w:] - c[:-w]])
+    cnts = np.concatenate([k[1:w], k[w:] - k[:-w]])
+    return sums, cnts
+
+def fast_ma(a: np.ndarray, w: int) -> np.ndarray:
+    sums, cnts = _roll_sum_cnt(a, w)
+    return np.where(cnts > 0, sums / np.maximum(cnts, 1), np.nan)
+
+def fast_roll_sum(a: np.ndarray, w: int) -> np.ndarray:
+    sums, cnts = _roll_sum_cnt(a, w)
+    return np.where(cnts > 0, sums, np.nan)
+
+# Shared derived-frame helpers. `key` is a cheap fingerprint of the load
+# parameters; the frame itself is passed underscore-prefixed so Streamlit
+# never hashes it. Tab switches then reuse the first computation.
+@st.cache_data(show_spinner=False)
+def monthly_frame(key, _frame: pd.DataFrame, month_num: int) -> pd.DataFrame:
+    # 'month' was materialized as int8 at load time — one np.equal over ints
+    # instead of re-extracting months from the datetimes on every rerun
+    return _frame[_frame['month'].values == np.int8(month_num)]
+
+@st.cache_data(show_spinner=False)
+def resample_ts(key, _frame: pd.DataFrame, rule: str):
+    ts = (
+        _frame.set_index('datetime').sort_index()
+        .resample(rule).agg({'traffic_volume': 'mean', 'average_speed': 'mean'})
+    )
+    # dynamic smoother window
+    w = int(np.clip(max(3, len(ts) // 20), 3, 24))
+    ts['vol_ma'] = fast_ma(ts['traffic_volume'].to_numpy(), w)
+    ts['spd_ma'] = fast_ma(ts['average_speed'].to_numpy(), w)
+    return ts, w
+
+# STL dominates CPU in the decomposition view. Fit on the raw value array
+# (cheap to hash) so the residual-window/aggregate widgets below the plot
+# don't re-run the decomposition.
+@st.cache_data(show_spinner=False)
+def run_stl(values: np.ndarray, period: int, seasonal_w: int, trend_w: int):
+    res = STL(values, period=period, seasonal=seasonal_w, trend=trend_w, robust=True).fit()
+    return res.trend, res.seasonal, res.resid
+
+# Top highs/lows plus their text labels (vectorized formatting), cached so
+# scrubbing the marks slider doesn't re-rank and re-format on every rerun.
+@st.cache_data(show_spinner=False)
+def mark_extremes(key, _s: pd.Series, n: int, fmt: str):
+    if n <= 0 or _s.dropna().empty:
+        empty = pd.Series(dtype=float)
+        return empty, empty, [], []
+    hi, lo = _s.nlargest(n), _s.nsmallest(n)
+    return hi, lo, np.char.mod(fmt, hi.values).tolist(), np.char.mod(fmt, lo.values).tolist()
+
+# Only the two target rows of the correlation matrix are needed, so compute
+# them in one NumPy pass (ranks first for spearman) instead of a full k x k
+# DataFrame.corr per target.
+@st.cache_data(show_spinner=False)
+def corr_with_targets(key, _join: pd.DataFrame, ext_feats: tuple, method: str):
+    arr = _join[list(ext_feats) + ['traffic_volume', 'average_speed']].to_numpy(dtype=np.float64)
+    arr = arr[~np.isnan(arr).any(axis=1)]
+    if method == 'spearman':
+        arr = np.apply_along_axis(rankdata, 0, arr)
+    c = np.corrcoef(arr.T)
+    corr_v = pd.Series(c[-2, :-2], index=list(ext_feats))
+    corr_s = pd.Series(c[-1, :-2], index=list(ext_feats))
+    return corr_v, corr_s
+
+# Cleaned point set + view center for the pydeck map, so tab switches and
+# unrelated widget moves don't re-slice/dropna the frame.
+@st.cache_data(show_spinner=False)
+def map_points(key, _frame: pd.DataFrame):
+    pts = _frame[['longitude', 'latitude', 'traffic_volume']].dropna()
+    return pts, float(pts['latitude'].mean()), float(pts['longitude'].mean())
+
+# Regional aggregation + figures depend only on the loaded frame, so cache
+# both on the load fingerprint — switching tabs or moving Time-tab widgets
+# never rebuilds them. go.Bar/go.Pie skip plotly.express's frame handling.
+@st.cache_data(show_spinner=False)
+def regional_agg(key, _frame: pd.DataFrame) -> pd.DataFrame:
+    return (
+        _frame.groupby('region_name', observed=True).agg(
+            total_volume=('traffic_volume', 'sum'),
+            avg_speed=('average_speed', 'mean'),
+            incident_count=('incidents', 'sum'),
+            record_count=('traffic_volume', 'count')
+        ).reset_index().sort_values('total_volume', ascending=False)
+    )
+
+@st.cache_data(show_spinner=False)
+def regional_figs(key, _agg: pd.DataFrame):
+    bar = go.Figure(go.Bar(x=_agg['total_volume'], y=_agg['region_name'], orientation='h'))
+    bar.update_layout(title='Total Volume by Region', height=450,
+                      yaxis={'categoryorder': 'total ascending'})
+    pie = go.Figure(go.Pie(labels=_agg['region_name'], values=_agg['total_volume'], hole=0.35))
+    pie.update_layout(title='Volume Share by Region', height=450)
+    return bar, pie
 
 # =============================
 # 4) Sidebar Filters
@@ -132,26 +316,32 @@ st.sidebar.header("🧹 Data Quality")
 max_speed = st.sidebar.number_input("Max speed (km/h)", 20, 200, 160, 5)
 max_volume = st.sidebar.number_input("Max vehicles/hour", 200, 20000, 10000, 100)
 robust_view = st.sidebar.checkbox("Robust view (winsorize 1–99%)", value=True)
+max_rows = st.sidebar.number_input("Max rows", 10000, 5000000, 500000, 50000,
+                                   help="載入上限：超過時提前停止，避免大月份拖垮記憶體。")
 
-# Load
-_df = load_data(client, selected_db, selected_month)
+# Load (guards are applied in the Mongo query itself)
+_df = load_data(client, selected_db, selected_month, max_speed, max_volume,
+                max_rows=max_rows)
 if _df.empty:
     st.warning(f"No data found in **{selected_db} / {selected_month}**")
     st.stop()
 
-# Apply guards
-if 'average_speed' in _df.columns:
-    _df.loc[_df['average_speed'] > max_speed, 'average_speed'] = np.nan
-if 'traffic_volume' in _df.columns:
-    _df.loc[_df['traffic_volume'] > max_volume, 'traffic_volume'] = np.nan
-if robust_view:
-    _df = winsorize(_df, ['traffic_volume', 'average_speed'])
-
-# Region filter
+# Region filter — re-query with the region predicate so only matching rows load
 regions = ["(All)"] + sorted(_df.get('region_name', pd.Series(dtype=str)).dropna().unique().tolist())
 selected_regions = st.sidebar.multiselect("Regions", regions, default=["(All)"])
 if "(All)" not in selected_regions:
-    _df = _df[_df['region_name'].isin(selected_regions)]
+    _df = load_data(client, selected_db, selected_month, max_speed, max_volume,
+                    regions=tuple(sorted(selected_regions)), max_rows=max_rows)
+    if _df.empty:
+        st.warning("No rows match the selected regions.")
+        st.stop()
+
+if robust_view:
+    _df = winsorize(_df, ['traffic_volume', 'average_speed'])
+
+# Fingerprint of everything that shaped _df — cache key for derived frames
+_df_key = (selected_db, selected_month, max_speed, max_volume, robust_view,
+           max_rows, tuple(sorted(selected_regions)), len(_df))
 
 # =============================
 # KPIs（含小問號說明）
@@ -183,8 +373,8 @@ with TAB_TIME:
         st.info("No datetime available.")
     else:
         month_num = month_names.index(selected_month) + 1
-        df_m = _df[_df['datetime'].dt.month == month_num].copy()
-        years = sorted(df_m['datetime'].dt.year.dropna().unique())
+        df_m = monthly_frame(_df_key, _df, month_num)
+        years = np.unique(df_m['year'].values).tolist()
         if not years:
             st.info("No rows for selected month.")
         else:
@@ -193,45 +383,35 @@ with TAB_TIME:
             gran = c2.radio("Granularity", ["Hourly", "Daily"], horizontal=True, index=0)
             marks = c3.slider("Mark top highs/lows", 0, 10, 3)
 
-            df_f = df_m[df_m['datetime'].dt.year == focus_year].copy()
+            df_f = df_m[df_m['year'].values == np.int16(focus_year)]
             if df_f.empty:
                 st.info(f"No data for {focus_year}-{month_num:02d}.")
             else:
                 rule = 'H' if gran == "Hourly" else 'D'
-                ts = (
-                    df_f.set_index('datetime').sort_index()
-                    .resample(rule).agg({'traffic_volume': 'mean', 'average_speed': 'mean'})
-                )
-
-                # dynamic smoother window
-                def _win(n): return int(np.clip(max(3, n // 20), 3, 24))
-                w = _win(len(ts))
-                ts['vol_ma'] = ts['traffic_volume'].rolling(w, min_periods=1).mean()
-                ts['spd_ma'] = ts['average_speed'].rolling(w, min_periods=1).mean()
+                ts, w = resample_ts((_df_key, month_num, focus_year), df_f, rule)
 
-                # helper to mark extremes
-                def _mark(s, n):
-                    if n <= 0 or s.dropna().empty:
-                        return pd.Series(dtype=float), pd.Series(dtype=float)
-                    return s.nlargest(n), s.nsmallest(n)
-
-                vol_hi, vol_lo = _mark(ts['traffic_volume'], marks)
-                spd_hi, spd_lo = _mark(ts['average_speed'], marks)
+                mark_key = (_df_key, month_num, focus_year, rule)
+                vol_hi, vol_lo, vol_hi_txt, vol_lo_txt = mark_extremes(
+                    (*mark_key, 'traffic_volume'), ts['traffic_volume'], marks, '%.0f')
+                spd_hi, spd_lo, spd_hi_txt, spd_lo_txt = mark_extremes(
+                    (*mark_key, 'average_speed'), ts['average_speed'], marks, '%.1f')
 
                 t1, t2 = st.columns(2)
                 start, end = ts.index.min(), ts.index.max()
 
                 with t1:
-                    fig = go.Figure()
+                    # resampler_fig sends only a screen-resolution subset of
+                    # each trace to the browser instead of every point.
+                    fig = resampler_fig(go.Figure())
                     fig.add_trace(go.Scatter(x=ts.index, y=ts['traffic_volume'], name='Volume', line=dict(width=1.5)))
                     fig.add_trace(go.Scatter(x=ts.index, y=ts['vol_ma'], name=f'{w}-pt MA', line=dict(width=3)))
                     if marks > 0 and len(vol_hi):
                         fig.add_trace(go.Scatter(x=vol_hi.index, y=vol_hi.values, mode='markers+text', name='Highs',
-                                                 text=[f"{v:.0f}" for v in vol_hi.values], textposition='top center',
+                                                 text=vol_hi_txt, textposition='top center',
                                                  marker=dict(size=9, symbol='triangle-up')))
                     if marks > 0 and len(vol_lo):
                         fig.add_trace(go.Scatter(x=vol_lo.index, y=vol_lo.values, mode='markers+text', name='Lows',
-                                                 text=[f"{v:.0f}" for v in vol_lo.values], textposition='bottom center',
+                                                 text=vol_lo_txt, textposition='bottom center',
                                                  marker=dict(size=9, symbol='triangle-down')))
                     fig.update_layout(title=f"Traffic Volume — {focus_year}-{month_num:02d} ({gran})", height=460,
                                       xaxis=dict(rangeslider=dict(visible=True), range=[start, end]), yaxis_title='veh/h',
@@ -239,16 +419,16 @@ with TAB_TIME:
                     st.plotly_chart(fig, use_container_width=True)
 
                 with t2:
-                    fig = go.Figure()
+                    fig = resampler_fig(go.Figure())
                     fig.add_trace(go.Scatter(x=ts.index, y=ts['average_speed'], name='Avg Speed', line=dict(width=1.5)))
                     fig.add_trace(go.Scatter(x=ts.index, y=ts['spd_ma'], name=f'{w}-pt MA', line=dict(width=3)))
                     if marks > 0 and len(spd_hi):
                         fig.add_trace(go.Scatter(x=spd_hi.index, y=spd_hi.values, mode='markers+text', name='Highs',
-                                                 text=[f"{v:.1f}" for v in spd_hi.values], textposition='top center',
+                                                 text=spd_hi_txt, textposition='top center',
                                                  marker=dict(size=9, symbol='triangle-up')))
                     if marks > 0 and len(spd_lo):
                         fig.add_trace(go.Scatter(x=spd_lo.index, y=spd_lo.values, mode='markers+text', name='Lows',
-                                                 text=[f"{v:.1f}" for v in spd_lo.values], textposition='bottom center',
+                                                 text=spd_lo_txt, textposition='bottom center',
                                                  marker=dict(size=9, symbol='triangle-down')))
                     fig.update_layout(title=f"Average Speed — {focus_year}-{month_num:02d} ({gran})", height=460,
                                       xaxis=dict(rangeslider=dict(visible=True), range=[start, end]), yaxis_title='km/h',
@@ -259,8 +439,8 @@ with TAB_TIME:
     st.subheader("（選配）季節/趨勢分解 — 單一軸控制（三排同步）")
     if 'datetime' in _df.columns:
         month_num = month_names.index(selected_month) + 1
-        df_m = _df[_df['datetime'].dt.month == month_num].copy()
-        years = sorted(df_m['datetime'].dt.year.dropna().unique().tolist())
+        df_m = monthly_frame(_df_key, _df, month_num)
+        years = np.unique(df_m['year'].values).tolist()
         if years:
             col_y, col_alg = st.columns([1, 2])
             decomp_year = col_y.selectbox("Year", years, index=len(years) - 1, key="dec_year")
@@ -271,7 +451,7 @@ with TAB_TIME:
                       "Seasonal Decompose (additive)：季節形狀固定、計算較快。")
             )
 
-            df_my = df_m[df_m['datetime'].dt.year == decomp_year].copy()
+            df_my = df_m[df_m['year'].values == np.int16(decomp_year)]
             ts_hourly = df_my.set_index('datetime').sort_index()['traffic_volume'].resample('H').mean().ffill()
             n = len(ts_hourly)
             if n >= 48:
@@ -282,9 +462,11 @@ with TAB_TIME:
                     seasonal_w = _odd(min(max(11, period), max(7, n // 8)))
                     trend_w    = _odd(min(max(35, period * 5), max(7, n // 2)))
                     st.caption(f"STL params → period={period}, seasonal={seasonal_w}, trend={trend_w}, robust=True")
-                    stl = STL(ts_hourly, period=period, seasonal=seasonal_w, trend=trend_w, robust=True)
-                    res = stl.fit()
-                    obs, trend, seas, resid = ts_hourly, res.trend, res.seasonal, res.resid
+                    trend_v, seas_v, resid_v = run_stl(ts_hourly.to_numpy(), period, seasonal_w, trend_w)
+                    obs = ts_hourly
+                    trend = pd.Series(trend_v, index=ts_hourly.index)
+                    seas = pd.Series(seas_v, index=ts_hourly.index)
+                    resid = pd.Series(resid_v, index=ts_hourly.index)
                 else:
                     dec = seasonal_decompose(ts_hourly, model='additive', period=period)
                     obs, trend, seas, resid = dec.observed, dec.trend, dec.seasonal, dec.resid
@@ -297,12 +479,15 @@ with TAB_TIME:
                 bottom_mode = c_roll3.radio("Bottom panel shows", ["Seasonal", "Residual", "Seasonal & Residual"],
                                             index=2, horizontal=True)
 
-                resid_roll = (resid.abs().rolling(roll_h, min_periods=1).sum()
-                              if roll_stat == "abs_sum"
-                              else getattr(resid.rolling(roll_h, min_periods=1), roll_stat)())
+                if roll_stat == "std":
+                    resid_roll = resid.rolling(roll_h, min_periods=1).std()
+                else:
+                    vals = np.abs(resid.to_numpy()) if roll_stat == "abs_sum" else resid.to_numpy()
+                    roll_fn = fast_ma if roll_stat == "mean" else fast_roll_sum
+                    resid_roll = pd.Series(roll_fn(vals, roll_h), index=resid.index)
 
                 # ---- 三排：上/中/下（中排只要 bar）----
-                fig = make_subplots(
+                fig = resampler_fig(make_subplots(
                     rows=3, cols=1, shared_xaxes=True,
                     specs=[[{"type": "xy"}], [{"type": "bar"}], [{"type": "xy"}]],
                     vertical_spacing=0.10,
@@ -312,26 +497,31 @@ with TAB_TIME:
                         f"Residual (rolling {roll_stat}, {roll_h}h) — Navigator",
                         "Seasonal / Residual (choose above)"
                     )
-                )
+                ))
+
+                # Plot downsampled views; STL itself ran on the full series
+                obs_p, trend_p = lttb_points(obs), lttb_points(trend)
+                seas_p, resid_p = lttb_points(seas), lttb_points(resid)
+                resid_roll_p = lttb_points(resid_roll)
 
                 # Row 1：Observed + Trend（線）
-                fig.add_trace(go.Scatter(x=obs.index, y=obs.values, name="Observed", line=dict(width=1.5)), row=1, col=1)
-                fig.add_trace(go.Scatter(x=trend.index, y=trend.values, name="Trend", line=dict(width=3)), row=1, col=1)
+                fig.add_trace(go.Scatter(x=obs_p.index, y=obs_p.values, name="Observed", line=dict(width=1.5)), row=1, col=1)
+                fig.add_trace(go.Scatter(x=trend_p.index, y=trend_p.values, name="Trend", line=dict(width=3)), row=1, col=1)
 
                 # Row 2：只放 rolling bar（不加任何其他元素/線/shape/legend）
                 fig.add_trace(
                      go.Scatter(
-                        x=resid_roll.index, 
-                        y=resid_roll.values, 
-                        fill='tozeroy',  mode='none',     
+                        x=resid_roll_p.index,
+                        y=resid_roll_p.values,
+                        fill='tozeroy',  mode='none',
                         showlegend=False,fillcolor='rgba(255, 82, 82, 0.5)' ),row=2, col=1
                 )
 
                 # Row 3：Seasonal / Residual（線）
                 if bottom_mode in ["Seasonal", "Seasonal & Residual"]:
-                    fig.add_trace(go.Scatter(x=seas.index, y=seas.values, name="Seasonal", line=dict(width=1.5)), row=3, col=1)
+                    fig.add_trace(go.Scatter(x=seas_p.index, y=seas_p.values, name="Seasonal", line=dict(width=1.5)), row=3, col=1)
                 if bottom_mode in ["Residual", "Seasonal & Residual"]:
-                    fig.add_trace(go.Scatter(x=resid.index, y=resid.values, name="Residual", line=dict(width=1)), row=3, col=1)
+                    fig.add_trace(go.Scatter(x=resid_p.index, y=resid_p.values, name="Residual", line=dict(width=1)), row=3, col=1)
 
                 # 同步 x；rangeslider 只在中排
                 # fig.update_xaxes(matches='x')
@@ -363,20 +553,21 @@ with TAB_SPATIAL:
     
     # Check for necessary columns
     if {'latitude', 'longitude', 'traffic_volume'}.issubset(_df.columns):
+        pts, center_lat, center_lon = map_points(_df_key, _df)
         c1, c2 = st.columns([2, 1])
         with c1:
             st.pydeck_chart(pdk.Deck(
                 map_style='mapbox://styles/mapbox/dark-v9',
                 initial_view_state=pdk.ViewState(
-                    latitude=_df['latitude'].mean(),
-                    longitude=_df['longitude'].mean(),
+                    latitude=center_lat,
+                    longitude=center_lon,
                     zoom=9,
                     pitch=50,
                 ),
                 layers=[
                     pdk.Layer(
                         'HexagonLayer',
-                        data=_df[['longitude', 'latitude', 'traffic_volume']].dropna(),
+                        data=pts,
                         get_position='[longitude, latitude]',
                         radius=200,
                         elevation_scale=4,
@@ -396,7 +587,7 @@ with TAB_SPATIAL:
             """)
             if 'region_name' in _df.columns:
                 st.metric("涵蓋區域數", _df['region_name'].nunique())
-            st.metric("地理座標點", f"{len(_df[['latitude', 'longitude']].dropna()):,}")
+            st.metric("地理座標點", f"{len(pts):,}")
 
     else:
         st.info("缺少 'latitude', 'longitude' 或 'traffic_volume' 欄位，無法繪製地圖。")
@@ -405,22 +596,14 @@ with TAB_SPATIAL:
 
     if 'region_name' in _df.columns:
         st.subheader("各區域流量與速度彙總")
-        agg = _df.groupby('region_name').agg(
-            total_volume=('traffic_volume', 'sum'),
-            avg_speed=('average_speed', 'mean'),
-            incident_count=('incidents', 'sum'),
-            record_count=('traffic_volume', 'count')
-        ).reset_index().sort_values('total_volume', ascending=False)
-        
+        agg = regional_agg(_df_key, _df)
+        bar_fig, pie_fig = regional_figs(_df_key, agg)
+
         c1, c2 = st.columns(2)
         with c1:
-            fig = px.bar(agg, x='total_volume', y='region_name', orientation='h', title='Total Volume by Region')
-            fig.update_layout(height=450, yaxis={'categoryorder':'total ascending'})
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(bar_fig, use_container_width=True)
         with c2:
-            fig = px.pie(agg, names='region_name', values='total_volume', title='Volume Share by Region', hole=0.35)
-            fig.update_layout(height=450)
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(pie_fig, use_container_width=True)
         
         st.dataframe(agg)
         st.download_button("Download regional summary CSV", data=to_csv_bytes(agg),
@@ -452,9 +635,9 @@ with TAB_TREND:
     st.subheader(f"平日 vs. 週末的 {metric_label} 變化")
     
     if {'dow', 'hour', selected_metric}.issubset(_df.columns):
-        # 1. 建立一個新欄位來區分工作日與週末
-        df_trend = _df.copy()
-        df_trend['day_type'] = df_trend['dow'].apply(lambda x: '週末 (Weekend)' if x >= 5 else '工作日 (Weekday)')
+        # 1. 建立一個新欄位來區分工作日與週末（CoW：欄位選取零複製）
+        df_trend = _df[['dow', 'hour', selected_metric]]
+        df_trend['day_type'] = np.where(df_trend['dow'].to_numpy() >= 5, '週末 (Weekend)', '工作日 (Weekday)')
 
         # 2. 進行分組計算
         daily_pattern = df_trend.groupby(['day_type', 'hour'])[selected_metric].median().reset_index()
@@ -489,7 +672,9 @@ with TAB_TREND:
     st.subheader("優化版熱力圖 (增加數值與對比色)")
 
     if {'dow', 'hour', 'average_speed'}.issubset(_df.columns):
-        pivot = _df.pivot_table(index='dow', columns='hour', values='average_speed', aggfunc='median')
+        # groupby on the int8 dow/hour columns factorizes over ints and skips
+        # pivot_table's index/margin machinery
+        pivot = _df.groupby(['dow', 'hour'], observed=True, sort=True)['average_speed'].median().unstack('hour')
         pivot.index = ['週一 (Mon)', '週二 (Tue)', '週三 (Wed)', '週四 (Thu)', '週五 (Fri)', '週六 (Sat)', '週日 (Sun)'][:len(pivot.index)]
         
         # 使用更有意義的顏色，並顯示數值
@@ -536,7 +721,11 @@ with TAB_CORR:
         rule = 'H' if freq == "Hourly" else 'D'
         base = (_df.set_index('datetime').sort_index()
                   .resample(rule).agg({'traffic_volume': 'mean', 'average_speed': 'mean', 'incidents': 'sum'}))
-        ext_r = (ext.set_index(dt_col).sort_index().resample(rule).mean())
+        # Resample only numeric columns — a mean over object columns forces
+        # slow fallback reductions and warnings on wide CSVs
+        ext_num = ext.select_dtypes(include=[np.number])
+        ext_r = (ext_num.set_index(ext[dt_col]).sort_index().resample(rule).mean()
+                 .dropna(axis=1, how='all'))
         join = base.join(ext_r, how='inner')
 
         num_cols = join.select_dtypes(include=[np.number]).columns.tolist()
@@ -545,8 +734,8 @@ with TAB_CORR:
         if not ext_feats:
             st.warning("找不到可用的數值型外部特徵。")
         else:
-            corr_v = join[ext_feats + ['traffic_volume']].corr(method=method)['traffic_volume'].drop('traffic_volume')
-            corr_s = join[ext_feats + ['average_speed']].corr(method=method)['average_speed'].drop('average_speed')
+            corr_v, corr_s = corr_with_targets(
+                (_df_key, rule, method, up.file_id, dt_col), join, tuple(ext_feats), method)
             b1, b2 = st.columns(2)
             with b1:
                 fig = px.bar(corr_v.sort_values(), x=corr_v.sort_values().values, y=corr_v.sort_values().index,
@@ -563,8 +752,27 @@ with TAB_CORR:
             st.subheader("關係檢視（含趨勢線）")
             y_target = st.selectbox("Target", ['traffic_volume', 'average_speed'], index=0)
             x_feat = st.selectbox("External feature", ext_feats, index=0)
-            fig = px.scatter(join.reset_index(), x=x_feat, y=y_target, trendline='ols', opacity=0.6,
-                             title=f"{x_feat} vs {y_target} ({freq})")
+            sub = join[[x_feat, y_target]].dropna().sort_values(x_feat)
+            if len(sub) > 5000:
+                # Too many points for an SVG scatter with a per-point OLS
+                # trendline — downsample (keeping extremes) and fit the line
+                # on the full data.
+                ds_idx = MinMaxLTTBDownsampler().downsample(
+                    sub[x_feat].to_numpy(dtype=np.float64),
+                    sub[y_target].to_numpy(dtype=np.float64), n_out=5000)
+                shown = sub.iloc[ds_idx]
+                # WebGL trace: SVG scatters degrade badly past a few thousand points
+                fig = go.Figure(go.Scattergl(
+                    x=shown[x_feat], y=shown[y_target], mode='markers',
+                    marker=dict(opacity=0.6), name=y_target))
+                slope, intercept = np.polyfit(sub[x_feat], sub[y_target], 1)
+                xs = np.array([sub[x_feat].min(), sub[x_feat].max()])
+                fig.add_trace(go.Scattergl(x=xs, y=slope * xs + intercept, mode='lines', name='OLS fit'))
+                fig.update_layout(title=f"{x_feat} vs {y_target} ({freq}, {len(shown):,}/{len(sub):,} shown)",
+                                  xaxis_title=x_feat, yaxis_title=y_target)
+            else:
+                fig = px.scatter(sub, x=x_feat, y=y_target, trendline='ols', opacity=0.6,
+                                 render_mode='webgl', title=f"{x_feat} vs {y_target} ({freq})")
             fig.update_layout(height=520)
             st.plotly_chart(fig, use_container_width=True)
 